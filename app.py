@@ -1,13 +1,22 @@
 import os
-import re
 import time
+import shutil
 import streamlit as st
 import spotipy
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from spotipy.oauth2 import SpotifyOAuth
-from youtubesearchpython import VideosSearch
+from spotipy.cache_handler import CacheHandler
 import yt_dlp
+import diskcache
 import tempfile
 import zipfile
+from collections import deque
+import subprocess
+import threading
+from dataclasses import dataclass, asdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 # ========= CONFIGURAÇÕES SPOTIFY ==========
 # Os valores são carregados dos 'secrets' do Streamlit
@@ -19,10 +28,42 @@ except KeyError:
     st.error("ERRO: As credenciais do Spotify (secrets) não foram encontradas. Configure SPOTIPY_CLIENT_ID, SPOTIPY_CLIENT_SECRET, e SPOTIPY_REDIRECT_URI nos segredos do seu app Streamlit.")
     st.stop()
 
+# Renova o token um pouco antes de expirar, para não falhar no meio de uma requisição
+MARGEM_EXPIRACAO_TOKEN = 60  # segundos
+# Intervalo mínimo entre atualizações da barra de progresso (evita re-renderizações em rajada)
+INTERVALO_PROGRESSO = 0.1  # segundos
+# Mensagens de status são agrupadas e exibidas juntas, no máximo a cada INTERVALO_STATUS
+INTERVALO_STATUS = 0.25  # segundos
+MENSAGENS_STATUS_VISIVEIS = 8
+# Por quanto tempo as músicas de uma playlist ficam em cache (mudanças na playlist aparecem depois disso)
+TTL_CACHE_PLAYLIST = 600  # segundos
+
+# ========= CONFIGURAÇÕES YT-DLP ==========
+# Opções de rede: fragmentos em paralelo, tentativas extras e HLS pelo downloader nativo
+OPCOES_REDE_YTDLP = {
+    'concurrent_fragment_downloads': 5,
+    'retries': 3, 'fragment_retries': 3,
+    'socket_timeout': 15,
+}
+# Cache em disco (artista, música) -> URL do vídeo, compartilhado entre sessões
+CAMINHO_CACHE_VIDEOS = ".spotdl_cache"
+# Se o aria2c estiver instalado, ele baixa cada faixa com várias conexões simultâneas.
+# O total de conexões é dividido entre os downloads simultâneos, para não abrir
+# dezenas de conexões ao mesmo tempo com o googlevideo.
+ARIA2C_DISPONIVEL = shutil.which('aria2c') is not None
+CONEXOES_ARIA2C = 16
+
 # ========= FUNÇÕES AUXILIARES ==========
+# Tabela de tradução montada uma única vez: str.translate remove os caracteres numa só passada
+_CARACTERES_INVALIDOS = str.maketrans("", "", '\\/*?:"<>|')
+
 def limpar_nome(nome):
     """Remove caracteres inválidos para nomes de arquivo."""
-    return re.sub(r'[\\/*?:"<>|]', "", nome)
+    return nome.translate(_CARACTERES_INVALIDOS)
+
+def nome_arquivo_musica(nome_musica, artista):
+    """Nome do arquivo (sem extensão) em que a música é salva."""
+    return f"{limpar_nome(artista)} - {limpar_nome(nome_musica)}"
 
 def get_playlist_id(url):
     """Extrai o ID da playlist de uma URL do Spotify."""
@@ -31,29 +72,129 @@ def get_playlist_id(url):
     except (IndexError, AttributeError):
         return None
 
+def extrair_faixas(itens):
+    """
+    Reduz os itens da API do Spotify a tuplas `(nome_musica, artista)`,
+    descartando o que não é uma música válida (faixas removidas, arquivos locais...).
+    """
+    return [
+        (item['track']['name'], item['track']['artists'][0]['name'])
+        for item in itens
+        if item.get('track') and item['track'].get('name') and item['track'].get('artists')
+    ]
+
+def adicionar_ao_zip(zf, trava_zip, caminho):
+    """
+    Grava o arquivo pronto no .zip e o apaga do disco, retornando o nome dentro do .zip.
+    Chamada pelas próprias threads de trabalho, por isso serializada por `trava_zip`.
+    """
+    nome_arquivo = os.path.basename(caminho)
+    with trava_zip:
+        zf.write(caminho, arcname=nome_arquivo)
+    os.remove(caminho)
+    return nome_arquivo
+
+def exibir_status(mensagens_status, problemas, trava_status, status_placeholder):
+    """
+    Mostra as mensagens publicadas pelas threads de download numa única
+    atualização do placeholder, em vez de re-renderizar a cada mensagem.
+    Avisos e erros (`problemas`) ficam todos visíveis, com o estilo do seu nível;
+    das demais mensagens, só as mais recentes.
+    """
+    with trava_status:
+        problemas = list(problemas)
+        mensagens = list(mensagens_status)
+    if not (problemas or mensagens):
+        return
+    with status_placeholder.container():
+        for nivel, mensagem in problemas:
+            getattr(st, nivel)(mensagem)
+        if mensagens:
+            st.markdown("\n\n".join(mensagens))
+
 # ========= FUNÇÕES DE AUTENTICAÇÃO (ESTRUTURA CORRETA) ==========
 
+@dataclass(slots=True)
+class TokenInfo:
+    """Só os campos do token que o app usa, no lugar do dict completo devolvido pelo Spotipy."""
+    access_token: str
+    refresh_token: str
+    expires_at: float
+    scope: str
+
+    @classmethod
+    def from_dict(cls, token_info):
+        return cls(
+            access_token=token_info['access_token'],
+            refresh_token=token_info['refresh_token'],
+            expires_at=token_info['expires_at'],
+            scope=token_info.get('scope', ''),
+        )
+
+class SessionStateCacheHandler(CacheHandler):
+    """
+    Guarda o token do Spotipy no st.session_state, como um TokenInfo.
+    O gerenciador de autenticação é compartilhado pelo processo inteiro, mas o
+    st.session_state é individual, então cada usuário continua com o seu token.
+    """
+    def get_cached_token(self):
+        token_info = st.session_state.get('token_info')
+        return asdict(token_info) if token_info else None
+
+    def save_token_to_cache(self, token_info):
+        st.session_state['token_info'] = TokenInfo.from_dict(token_info)
+
+@st.cache_resource
+def get_sessao_http():
+    """
+    Cria (uma vez por processo) a sessão HTTP usada pelos clientes Spotipy, para
+    reaproveitar as conexões keep-alive com a API do Spotify entre páginas e reruns.
+    """
+    sessao = requests.Session()
+    adaptador = HTTPAdapter(
+        pool_connections=10, pool_maxsize=10,
+        max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504))
+    )
+    sessao.mount("https://", adaptador)
+    return sessao
+
+class ClienteSpotify(spotipy.Spotify):
+    """
+    Cliente Spotipy que usa a sessão HTTP compartilhada do processo.
+    O Spotify.__del__ original fecha a sessão recebida, o que limparia as conexões
+    que outros clientes (e outros usuários) ainda estão usando.
+    """
+    def __init__(self, access_token):
+        super().__init__(auth=access_token, requests_session=get_sessao_http(), retries=0)
+
+    def __del__(self):
+        pass
+
+@st.cache_resource
+def get_cache_videos():
+    """Abre (uma vez por processo) o cache em disco de vídeos do YouTube já encontrados."""
+    return diskcache.Cache(CAMINHO_CACHE_VIDEOS)
+
 @st.cache_resource
 def get_auth_manager():
-    """Cria e armazena em cache o gerenciador de autenticação do Spotipy."""
+    """Cria e armazena em cache (uma vez por processo) o gerenciador de autenticação do Spotipy."""
     return SpotifyOAuth(
         client_id=CLIENT_ID,
         client_secret=CLIENT_SECRET,
         redirect_uri=REDIRECT_URI,
         scope="playlist-read-private",
-        cache_path=None
+        cache_handler=SessionStateCacheHandler()
     )
 
 def get_token_from_code():
     """
     Função chamada APENAS na primeira vez, quando o 'code' está na URL.
-    Troca o código por um token e o armazena no estado da sessão.
+    Troca o código por um token, que o SessionStateCacheHandler armazena no estado da sessão.
     """
     auth_manager = get_auth_manager()
     try:
         code = st.query_params['code']
-        token_info = auth_manager.get_access_token(code, as_dict=True)
-        st.session_state['token_info'] = token_info
+        auth_manager.get_access_token(code, as_dict=True)
         st.query_params.clear() 
     except (KeyError, Exception) as e:
         st.error("Ocorreu um erro ao tentar obter o token de acesso.")
@@ -73,18 +214,26 @@ def get_spotify_client():
 
     token_info = st.session_state['token_info']
     
-    if auth_manager.is_token_expired(token_info):
+    # Só vai ao accounts.spotify.com quando o token guardado está de fato perto de expirar
+    if time.time() >= token_info.expires_at - MARGEM_EXPIRACAO_TOKEN:
         try:
-            refreshed_token_info = auth_manager.refresh_access_token(token_info['refresh_token'])
-            st.session_state['token_info'] = refreshed_token_info
-            token_info = refreshed_token_info
+            # O SessionStateCacheHandler guarda o token renovado no estado da sessão
+            auth_manager.refresh_access_token(token_info.refresh_token)
+            token_info = st.session_state['token_info']
         except Exception as e:
             st.error("Sua sessão expirou. Por favor, faça o login novamente.")
             del st.session_state['token_info']
+            st.session_state.pop('user_id', None)
             show_login_page()
             st.stop()
             
-    return spotipy.Spotify(auth=token_info['access_token'])
+    return ClienteSpotify(token_info.access_token)
+
+def get_user_id(sp):
+    """Retorna o ID do usuário logado, buscado uma única vez por sessão."""
+    if 'user_id' not in st.session_state:
+        st.session_state['user_id'] = sp.current_user()['id']
+    return st.session_state['user_id']
 
 def show_login_page():
     """Mostra a página de login para o usuário iniciar o processo."""
@@ -96,57 +245,147 @@ def show_login_page():
     st.link_button("Fazer Login com Spotify", auth_url, use_container_width=True, type="primary")
 
 # ========= FUNÇÕES PRINCIPAIS (CACHE) ==========
+# Projeção das páginas de faixas: só o nome da faixa e dos artistas
+CAMPOS_FAIXAS = "items(track(name,artists(name))),next"
 
-@st.cache_data
-def get_todas_as_musicas(_sp_auth_token, playlist_id): 
+@st.cache_data(ttl=TTL_CACHE_PLAYLIST)
+def get_todas_as_musicas(playlist_id, user_id, limite=None): 
     """
-    Busca TODAS as músicas de uma playlist.
-    O cache funciona porque o token de acesso (uma string) e o playlist_id são 'hasheáveis'.
+    Busca o nome e TODAS as músicas de uma playlist, retornando `(nome, musicas)`,
+    onde `musicas` é uma lista de tuplas `(nome_musica, artista)` sem repetições.
+    Com `limite`, para de paginar assim que houver músicas suficientes.
+    A chave do cache é (playlist_id, user_id, limite), que não muda quando o Spotify
+    renova o token de acesso; o token é lido do st.session_state dentro da função.
+    As entradas expiram após TTL_CACHE_PLAYLIST para refletir mudanças na playlist.
+    Erros são propagados (e não cacheados): quem chama decide como exibi-los.
     """
-    try:
-        # Criamos um cliente temporário dentro da função cacheada
-        sp_temp = spotipy.Spotify(auth=_sp_auth_token)
-        resultados = sp_temp.playlist_items(playlist_id)
-        musicas = resultados['items']
-        while resultados['next']:
-            resultados = sp_temp.next(resultados)
-            musicas.extend(resultados['items'])
-        return musicas
-    except Exception as e:
-        st.error(f"Não foi possível buscar as músicas da playlist. Verifique a URL e suas permissões. Erro: {e}")
-        return []
+    # Criamos um cliente temporário dentro da função cacheada
+    sp_temp = ClienteSpotify(st.session_state['token_info'].access_token)
+    # Uma só chamada traz o nome e a primeira página de faixas. Só usamos o nome
+    # da faixa e dos artistas: 'fields' poda o JSON no servidor
+    playlist = sp_temp.playlist(
+        playlist_id,
+        fields=f"name,tracks({CAMPOS_FAIXAS})",
+        market="from_token",
+        additional_types=("track",)
+    )
+    resultados = playlist['tracks']
+    # Faixas com o mesmo nome de arquivo (repetidas, ou que só diferem em caracteres
+    # removidos por limpar_nome) seriam gravadas no mesmo caminho: o dict, indexado
+    # pelo nome do arquivo, mantém a ordem e descarta essas duplicatas antes do limite
+    musicas = {}
+    def adicionar_faixas(itens):
+        for nome_musica, artista in extrair_faixas(itens):
+            musicas.setdefault(nome_arquivo_musica(nome_musica, artista), (nome_musica, artista))
+
+    adicionar_faixas(resultados['items'])
+    # As páginas seguintes são pedidas explicitamente (e não via sp.next), porque a URL
+    # 'next' montada pelo Spotify não garante manter o 'fields' e o 'market'
+    offset = len(resultados['items'])
+    while resultados['next'] and resultados['items'] and not (limite and len(musicas) >= limite):
+        resultados = sp_temp.playlist_items(
+            playlist_id,
+            fields=CAMPOS_FAIXAS,
+            limit=100,
+            offset=offset,
+            market="from_token",
+            additional_types=("track",)
+        )
+        offset += len(resultados['items'])
+        adicionar_faixas(resultados['items'])
+    return playlist['name'], list(musicas.values())
+
+def opcoes_rede_ytdlp(downloads_simultaneos=1):
+    """Monta as opções de rede do yt-dlp, usando o aria2c quando disponível."""
+    if not ARIA2C_DISPONIVEL:
+        # Sem aria2c, o downloader HTTP nativo baixa em pedaços de 10 MB
+        return {
+            **OPCOES_REDE_YTDLP,
+            'http_chunk_size': 10 * 1024 * 1024,
+            'external_downloader': {'m3u8': 'native'},
+        }
+    conexoes = max(1, CONEXOES_ARIA2C // downloads_simultaneos)
+    return {
+        **OPCOES_REDE_YTDLP,
+        'external_downloader': {'default': 'aria2c', 'm3u8': 'native'},
+        'external_downloader_args': {'aria2c': [f'-x{conexoes}', f'-s{conexoes}', '-k1M']},
+    }
 
-def baixar_musica(nome_musica, artista, pasta_destino, status_placeholder):
-    """Busca no YouTube e baixa a música como MP3 usando yt-dlp."""
-    nome_arquivo_base = f"{limpar_nome(artista)} - {limpar_nome(nome_musica)}"
+def criar_youtube_dl(audio_original=False, downloads_simultaneos=1):
+    """
+    Cria uma instância do yt-dlp para ser reaproveitada em vários downloads,
+    mantendo extratores e conexões HTTP abertas entre uma faixa e outra.
+    O 'outtmpl' é definido a cada download por `baixar_musica`.
+    """
+    return yt_dlp.YoutubeDL({
+        'format': 'bestaudio[ext=m4a]/bestaudio' if audio_original else 'bestaudio/best',
+        'default_search': 'ytsearch1',
+        'quiet': True, 'noplaylist': True,
+        **opcoes_rede_ytdlp(downloads_simultaneos),
+    })
+
+def baixar_musica(nome_musica, artista, pasta_destino, reportar, cache_videos, ydl_local, audio_original=False):
+    """
+    Busca no YouTube e baixa o áudio original usando yt-dlp (sem converter).
+    A conversão para MP3 fica a cargo de `converter_para_mp3`, para que o
+    ffmpeg de uma faixa rode enquanto a próxima ainda está sendo baixada.
+    Com `audio_original`, prefere o stream M4A e o arquivo baixado já é o final.
+    O vídeo encontrado para cada (artista, música) fica em `cache_videos`, então
+    buscas repetidas (nesta ou em outras sessões) vão direto ao download.
+    `ydl_local` é um threading.local com a instância do yt-dlp desta thread
+    (ver `criar_youtube_dl`), já que uma mesma instância não pode ser
+    compartilhada entre downloads simultâneos.
+    Roda em threads de trabalho, então não toca nos widgets do Streamlit:
+    as mensagens de status são enviadas via `reportar(nivel, mensagem)`.
+    """
+    nome_arquivo_base = nome_arquivo_musica(nome_musica, artista)
     caminho_completo = os.path.join(pasta_destino, nome_arquivo_base)
+    chave_cache = f"{artista}\x00{nome_musica}"
 
     try:
         busca = f"{artista} - {nome_musica} official audio"
-        status_placeholder.info(f"🔎 Buscando: {busca}...")
-        resultado = VideosSearch(busca, limit=1, timeout=10).result()
+        video_url = cache_videos.get(chave_cache)
+        reportar('info', f"⬇️ Baixando: {nome_arquivo_base}" if video_url else f"🔎 Buscando e baixando: {busca}...")
+        ydl = ydl_local.ydl
+        ydl.params['outtmpl'] = {'default': f"{caminho_completo}.%(ext)s"}
+        # Sem cache, o pseudo-URL 'ytsearch1:' faz a busca e o download numa única chamada.
+        info = ydl.extract_info(video_url or f"ytsearch1:{busca}", download=True)
 
-        if not resultado or not resultado.get('result'):
-            status_placeholder.warning(f"⚠️ Não encontrado no YouTube: {busca}")
+        entradas = [info] if video_url else (info or {}).get('entries') or []
+        if not entradas:
+            reportar('warning', f"⚠️ Não encontrado no YouTube: {busca}")
             return None
 
-        video_url = resultado['result'][0]['link']
-        status_placeholder.info(f"⬇️ Baixando: {nome_arquivo_base}")
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'outtmpl': f"{caminho_completo}.%(ext)s",
-            'postprocessors': [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3', 'preferredquality': '192'}],
-            'quiet': True, 'noplaylist': True,
-        }
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([video_url])
-        
-        caminho_final_arquivo = f"{caminho_completo}.mp3"
-        status_placeholder.success(f"✅ Sucesso: {nome_arquivo_base}")
-        return caminho_final_arquivo
+        if not video_url:
+            cache_videos.set(chave_cache, entradas[0]['webpage_url'])
+        caminho_arquivo = entradas[0]['requested_downloads'][0]['filepath']
+        if audio_original:
+            reportar('success', f"✅ Sucesso: {os.path.basename(caminho_arquivo)}")
+        return caminho_arquivo
 
     except Exception as e:
-        status_placeholder.error(f"❌ Erro ao baixar {nome_arquivo_base}: {str(e)}")
+        # O vídeo guardado pode ter saído do ar: a próxima tentativa volta a buscar
+        cache_videos.delete(chave_cache)
+        reportar('error', f"❌ Erro ao baixar {nome_arquivo_base}: {str(e)}")
+        return None
+
+def converter_para_mp3(caminho_audio, reportar):
+    """Converte o áudio baixado para MP3 com o ffmpeg e apaga o arquivo original."""
+    caminho_mp3 = f"{os.path.splitext(caminho_audio)[0]}.mp3"
+    nome_arquivo = os.path.basename(caminho_mp3)
+
+    try:
+        reportar('info', f"🎛️ Convertendo: {nome_arquivo}")
+        subprocess.run(
+            ['ffmpeg', '-y', '-loglevel', 'error', '-i', caminho_audio, '-vn', '-codec:a', 'libmp3lame', '-b:a', '192k', caminho_mp3],
+            check=True, capture_output=True
+        )
+        os.remove(caminho_audio)
+        reportar('success', f"✅ Sucesso: {nome_arquivo}")
+        return caminho_mp3
+
+    except (subprocess.CalledProcessError, OSError) as e:
+        reportar('error', f"❌ Erro ao converter {nome_arquivo}: {str(e)}")
         return None
 
 # ========= INTERFACE PRINCIPAL DO APP ==========
@@ -162,6 +401,14 @@ def show_main_app(sp):
             "🎵 Máximo de músicas a baixar (0 = todas)", min_value=0, value=10, step=1,
             help="Se 0, tentará baixar todas as músicas da playlist."
         )
+        downloads_simultaneos = st.number_input(
+            "⚡ Downloads simultâneos", min_value=1, max_value=8, value=4, step=1,
+            help="Quantas músicas são buscadas e baixadas ao mesmo tempo."
+        )
+        audio_original = st.checkbox(
+            "🎧 Baixar áudio original (sem transcodificar)",
+            help="Mantém o áudio como o YouTube entrega (.m4a/.webm), sem converter para MP3. Mais rápido e sem perda extra de qualidade."
+        )
 
     if st.button("Iniciar Download", type="primary", use_container_width=True):
         playlist_id = get_playlist_id(url_playlist)
@@ -169,11 +416,14 @@ def show_main_app(sp):
             st.error("Por favor, insira uma URL de playlist do Spotify válida.")
         else:
             with st.spinner("Buscando informações da playlist..."):
-                token_de_acesso = st.session_state['token_info']['access_token']
-                todas_as_musicas = get_todas_as_musicas(token_de_acesso, playlist_id)
+                try:
+                    nome_playlist, todas_as_musicas = get_todas_as_musicas(playlist_id, get_user_id(sp), limite=limite_download if limite_download > 0 else None)
+                except Exception as e:
+                    st.error(f"Não foi possível buscar as músicas da playlist. Verifique a URL e suas permissões. Erro: {e}")
+                    nome_playlist, todas_as_musicas = None, []
             
             if todas_as_musicas:
-                st.info(f"🎶 Playlist encontrada com {len(todas_as_musicas)} músicas.")
+                st.info(f"🎶 Playlist encontrada ({len(todas_as_musicas)} músicas carregadas).")
                 musicas_a_processar = todas_as_musicas[:limite_download] if limite_download > 0 else todas_as_musicas
 
                 if musicas_a_processar:
@@ -184,26 +434,106 @@ def show_main_app(sp):
                     with tempfile.TemporaryDirectory() as temp_dir:
                         arquivos_baixados = []
                         total_a_baixar = len(musicas_a_processar)
-                        for i, item in enumerate(musicas_a_processar):
-                            musica = item.get('track')
-                            if musica and musica.get('name'):
-                                st.markdown(f"--- \n **Música {i + 1}/{total_a_baixar}**")
-                                caminho = baixar_musica(musica['name'], musica['artists'][0]['name'], temp_dir, status_placeholder)
-                                if caminho: arquivos_baixados.append(caminho)
-                            else:
-                                st.warning(f"Item {i+1} pulado (não é uma música válida).")
-                            progress_bar.progress((i + 1) / total_a_baixar)
-                            time.sleep(0.5)
+                        # Widgets do Streamlit não são thread-safe: as threads publicam o
+                        # status neste deque e a thread principal o exibe periodicamente.
+                        # Avisos e erros vão para uma lista sem limite, para nenhuma falha
+                        # sumir da tela antes de ser exibida.
+                        mensagens_status = deque(maxlen=MENSAGENS_STATUS_VISIVEIS)
+                        problemas = []
+                        trava_status = threading.Lock()
+                        # Cada mensagem nova incrementa a versão; o placeholder só é redesenhado
+                        # quando ela muda desde a última exibição
+                        versao_status = versao_exibida = 0
+                        def reportar(nivel, mensagem):
+                            nonlocal versao_status
+                            with trava_status:
+                                versao_status += 1
+                                if nivel in ('warning', 'error'):
+                                    problemas.append((nivel, mensagem))
+                                else:
+                                    mensagens_status.append(mensagem)
+
+                        nome_playlist = limpar_nome(nome_playlist)
+                        caminho_zip = os.path.join(temp_dir, f"{nome_playlist}.zip")
+                        cache_videos = get_cache_videos()
+
+                        # Uma instância do yt-dlp por thread de download, criada quando a thread sobe
+                        ydl_local = threading.local()
+                        instancias_ydl = []
+                        def iniciar_thread_download():
+                            ydl_local.ydl = criar_youtube_dl(audio_original, int(downloads_simultaneos))
+                            instancias_ydl.append(ydl_local.ydl)
+
+                        # Pipeline em dois estágios: as threads de download buscam o áudio
+                        # e o conversor (ffmpeg, limitado por CPU, um processo por núcleo) transcodifica
+                        # cada faixa assim que ela chega, sem segurar o próximo download.
+                        # Quem produz o arquivo final já o grava no .zip e o apaga em seguida,
+                        # então o disco nunca guarda a playlist inteira e a thread principal
+                        # só acompanha o progresso. O .zip é montado a partir dos caminhos
+                        # devolvidos pelas threads, sem varrer o diretório temporário.
+                        # ZIP_STORED de propósito: áudio já é comprimido e DEFLATE só gastaria
+                        # CPU para ganhar menos de 1%. allowZip64 cobre playlists acima de 4 GB.
+                        with zipfile.ZipFile(caminho_zip, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as zf, \
+                                ThreadPoolExecutor(max_workers=int(downloads_simultaneos), initializer=iniciar_thread_download) as executor, \
+                                ThreadPoolExecutor(max_workers=min(os.cpu_count() or 1, int(downloads_simultaneos))) as conversor:
+                            trava_zip = threading.Lock()
+
+                            def guardar_no_zip(caminho):
+                                # Uma falha ao gravar (disco cheio, arquivo já removido...) perde só esta faixa
+                                try:
+                                    return adicionar_ao_zip(zf, trava_zip, caminho)
+                                except Exception as e:
+                                    reportar('error', f"❌ Erro ao adicionar {os.path.basename(caminho)} ao .zip: {str(e)}")
+                                    return None
+
+                            def baixar_e_guardar(nome_musica, artista):
+                                caminho = baixar_musica(nome_musica, artista, temp_dir, reportar, cache_videos, ydl_local, audio_original)
+                                return guardar_no_zip(caminho) if caminho and audio_original else caminho
+
+                            def converter_e_guardar(caminho_audio):
+                                caminho_mp3 = converter_para_mp3(caminho_audio, reportar)
+                                return guardar_no_zip(caminho_mp3) if caminho_mp3 else None
+
+                            downloads = {
+                                executor.submit(baixar_e_guardar, nome_musica, artista)
+                                for nome_musica, artista in musicas_a_processar
+                            }
+
+                            concluidos = 0
+                            ultima_atualizacao = ultimo_status = time.monotonic()
+                            pendentes = set(downloads)
+                            try:
+                                while pendentes:
+                                    # O timeout garante que o status seja exibido mesmo sem faixas concluídas
+                                    prontos, pendentes = wait(pendentes, timeout=INTERVALO_STATUS, return_when=FIRST_COMPLETED)
+                                    if versao_status != versao_exibida and time.monotonic() - ultimo_status >= INTERVALO_STATUS:
+                                        versao_exibida = versao_status
+                                        exibir_status(mensagens_status, problemas, trava_status, status_placeholder)
+                                        ultimo_status = time.monotonic()
+                                    for future in prontos:
+                                        resultado = future.result()
+                                        if future in downloads and resultado and not audio_original:
+                                            pendentes.add(conversor.submit(converter_e_guardar, resultado))
+                                            continue
+                                        if resultado: arquivos_baixados.append(resultado)
+                                        concluidos += 1
+                                        agora = time.monotonic()
+                                        if concluidos == total_a_baixar or agora - ultima_atualizacao >= INTERVALO_PROGRESSO:
+                                            progress_bar.progress(concluidos / total_a_baixar, text=f"Música {concluidos}/{total_a_baixar}")
+                                            ultima_atualizacao = agora
+                            finally:
+                                # Stop/rerun do Streamlit (ou erro): descarta os downloads que ainda
+                                # estão na fila, senão o script ficaria preso até a playlist terminar.
+                                # Num término normal não sobra nada na fila e isto não tem efeito.
+                                executor.shutdown(wait=False, cancel_futures=True)
+                                conversor.shutdown(wait=False, cancel_futures=True)
+                                for ydl in instancias_ydl:
+                                    ydl.close()
+
+                        if versao_status != versao_exibida:
+                            exibir_status(mensagens_status, problemas, trava_status, status_placeholder)
 
                         if arquivos_baixados:
-                            st.success("✅ Download de faixas concluído! Preparando o arquivo .zip...")
-                            nome_playlist = limpar_nome(sp.playlist(playlist_id)['name'])
-                            caminho_zip = os.path.join(temp_dir, f"{nome_playlist}.zip")
-                            
-                            with zipfile.ZipFile(caminho_zip, 'w') as zf:
-                                for arquivo_mp3 in arquivos_baixados:
-                                    zf.write(arquivo_mp3, arcname=os.path.basename(arquivo_mp3))
-                            
                             st.success(f"🎉 Arquivo '{nome_playlist}.zip' pronto!")
                             with open(caminho_zip, "rb") as f:
                                 st.download_button("Clique aqui para baixar o .zip", f, f"{nome_playlist}.zip", "application/zip", use_container_width=True)